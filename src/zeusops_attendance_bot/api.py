@@ -1,16 +1,32 @@
 """Client bindings to a REST API"""
 
 from datetime import datetime, timedelta
-from typing import Any
-
-from discord import Client, Guild, Intents, Message, TextChannel
-
-from zeusops_attendance_bot.models import AttendanceMsg, to_json
-from zeusops_attendance_bot.parsing import (
-    parse_full_attendance_history,
-    process_one_line,
+from pathlib import Path
+from typing import Any, Optional
+
+from discord import (
+    Client,
+    Guild,
+    Intents,
+    Message,
+    NotFound,
+    RawBulkMessageDeleteEvent,
+    RawMessageDeleteEvent,
+    RawMessageUpdateEvent,
+    RawReactionActionEvent,
+    TextChannel,
 )
+
+from zeusops_attendance_bot.diagnostics import ParseDiagnostics
+from zeusops_attendance_bot.models import AttendanceMsg, OperationAttendance, to_json
+from zeusops_attendance_bot.parsing import process_one_line
 from zeusops_attendance_bot.preprocess import preprocess_history
+from zeusops_attendance_bot.resolve import (
+    NameResolver,
+    resolutions_to_json,
+    resolve_attendance_users,
+)
+from zeusops_attendance_bot.server import AttendanceServer, AttendanceState
 
 Secret = str
 
@@ -30,6 +46,12 @@ NEW_OP_MARKER_EMOJI: str = "🆕"
 ZEUSOPS_ATTENDANCE_CHANNEL_ID: DiscordID = 817815909565202493
 ZEUSOPS_TEST_CHANNEL_ID: DiscordID = 530411066585382912
 
+LIVE_DIAGNOSTICS_INTERVAL: float = 5.0
+"""Minimum seconds between two live-logged parse failures"""
+
+DEFAULT_HTTP_HOST: str = "127.0.0.1"
+"""The interface to serve the attendance HTTP API on by default: local only"""
+
 
 class AttendanceClient(Client):
     """A discord Client for recording attendance"""
@@ -38,11 +60,38 @@ class AttendanceClient(Client):
     attendance_channel: TextChannel
     debug: bool = False
 
-    def __init__(self, debug, *args, **kwargs):
-        """Initialize the Client"""
+    def __init__(
+        self,
+        debug,
+        *args,
+        http_port: Optional[int] = None,
+        http_host: str = DEFAULT_HTTP_HOST,
+        **kwargs,
+    ):
+        """Initialize the Client, serving attendance over HTTP if given a port"""
         super().__init__(*args, **kwargs)
         self.debug = debug
+        self.http_port = http_port
+        self.http_host = http_host
+        self.state = AttendanceState()
+        self.server = AttendanceServer(self.state)
         self.listen_channels = [ZEUSOPS_ATTENDANCE_CHANNEL_ID, ZEUSOPS_TEST_CHANNEL_ID]
+        self.attendance_channel_id = get_attendance_channel_id(debug)
+        """The channel whose messages are attendance, served over HTTP if enabled"""
+        self.live_diagnostics = ParseDiagnostics(
+            live_log_interval=LIVE_DIAGNOSTICS_INTERVAL
+        )
+
+    async def setup_hook(self):
+        """Start the HTTP API, if enabled, before connecting to discord"""
+        if self.http_port is not None:
+            await self.server.start(self.http_host, self.http_port)
+
+    async def close(self):
+        """Stop the HTTP API along with the client, reporting pending failures"""
+        await self.server.stop()
+        self.live_diagnostics.flush()
+        await super().close()
 
     async def on_ready(self):
         """Entrypoint on app connected to discord"""
@@ -56,7 +105,9 @@ class AttendanceClient(Client):
         )
         history_dict = await grab_history(self.attendance_channel, debug=self.debug)
         save_attendance(history_dict)
-        parse_attendance_history(history_dict)
+        ops = parse_attendance_history(history_dict, self.state)
+        members = get_member_names(self.attendance_channel)
+        save_resolutions(ops, NameResolver.from_history(members, history_dict))
         # Exit on completion
         # await self.close()
 
@@ -73,19 +124,68 @@ class AttendanceClient(Client):
             return
         message_obj = to_obj(message)
         print(message_obj.json(indent=2))
+        if message.channel.id == self.attendance_channel_id:
+            self.state.add(message_obj)
         message_objs = preprocess_history([message_obj])
         for msg_obj in message_objs:
-            parsed = process_one_line(msg_obj, datetime.now().date().isoformat())
+            parsed = process_one_line(
+                msg_obj, datetime.now().date(), self.live_diagnostics
+            )
             if not parsed:
                 return
             print(f"Squad Attendance: {parsed}")
 
+    async def on_raw_message_edit(self, payload: RawMessageUpdateEvent):
+        """Hear edits to attendance messages, even those not in cache"""
+        if payload.channel_id == self.attendance_channel_id:
+            await self.refresh_message(payload.message_id)
+
+    async def on_raw_reaction_add(self, payload: RawReactionActionEvent):
+        """Hear attendance messages being flagged"""
+        if payload.channel_id == self.attendance_channel_id:
+            await self.refresh_message(payload.message_id)
+
+    async def on_raw_reaction_remove(self, payload: RawReactionActionEvent):
+        """Hear attendance messages being unflagged"""
+        if payload.channel_id == self.attendance_channel_id:
+            await self.refresh_message(payload.message_id)
+
+    async def on_raw_message_delete(self, payload: RawMessageDeleteEvent):
+        """Hear attendance messages being deleted"""
+        if payload.channel_id == self.attendance_channel_id:
+            self.state.remove(payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload: RawBulkMessageDeleteEvent):
+        """Hear attendance messages being deleted by moderators, in bulk"""
+        if payload.channel_id == self.attendance_channel_id:
+            for message_id in payload.message_ids:
+                self.state.remove(message_id)
+
+    async def refresh_message(self, message_id: DiscordID):
+        """Fetch a changed attendance message, replacing it in attendance state"""
+        channel = self.get_channel(self.attendance_channel_id)
+        if not isinstance(channel, TextChannel):
+            return
+        try:
+            message = await channel.fetch_message(message_id)
+        except NotFound:  # Deleted since: its own delete event follows
+            return
+        self.state.replace(to_obj(message))
+
 
-def get_client(debug_mode: bool) -> Client:
+def get_client(
+    debug_mode: bool,
+    http_port: Optional[int] = None,
+    http_host: str = DEFAULT_HTTP_HOST,
+) -> Client:
     """Get a Discord client with necessary intents"""
     intents = Intents.default()
     intents.message_content = True
-    client = AttendanceClient(intents=intents, debug=debug_mode)
+    # Privileged: without it, guild (and channel) members are only those cached
+    intents.members = True
+    client = AttendanceClient(
+        intents=intents, debug=debug_mode, http_port=http_port, http_host=http_host
+    )
     return client
 
 
@@ -100,10 +200,19 @@ def get_zeusops_server(client: Client) -> Guild:
     return client.get_guild(ZEUSOPS_GUILD_ID)
 
 
+def get_attendance_channel_id(debug: bool) -> DiscordID:
+    """Get the ID of the channel to record attendance of"""
+    return ZEUSOPS_TEST_CHANNEL_ID if debug else ZEUSOPS_ATTENDANCE_CHANNEL_ID
+
+
 def get_attendance_channel(zeusops_guild: Guild, debug: bool) -> TextChannel:
     """Grab the Zeusops attendance channel by ID"""
-    channel_id = ZEUSOPS_TEST_CHANNEL_ID if debug else ZEUSOPS_ATTENDANCE_CHANNEL_ID
-    return zeusops_guild.get_channel(channel_id)
+    return zeusops_guild.get_channel(get_attendance_channel_id(debug))
+
+
+def get_member_names(channel: TextChannel) -> dict[DiscordID, str]:
+    """Grab the display name of each member of a channel, by ID"""
+    return {member.id: member.display_name for member in channel.members}
 
 
 def is_flagged(msg: Message, emoji: str) -> bool:
@@ -156,7 +265,25 @@ def save_attendance(messages: ChannelAttendance):
         print("Completed")
 
 
-def parse_attendance_history(history_msgs: ChannelAttendance):
-    """Process the JSON-able dict of history into full attendance"""
-    preprocessed = preprocess_history(history_msgs)
-    parse_full_attendance_history(preprocessed)
+def parse_attendance_history(
+    history_msgs: ChannelAttendance, state: AttendanceState
+) -> list[OperationAttendance]:
+    """Process the JSON-able dict of history into full attendance, kept in state"""
+    diagnostics = ParseDiagnostics()
+    state.reset(history_msgs, diagnostics)
+    diagnostics.save(Path("parse_diagnostics.json"))
+    print(
+        f"{diagnostics.failure_count} lines failed parsing, "
+        f"{diagnostics.flagged_count} skipped as flagged bad, "
+        "see parse_diagnostics.json"
+    )
+    return state.ops
+
+
+def save_resolutions(ops: list[OperationAttendance], resolver: NameResolver):
+    """Resolve attendance usernames to member IDs, saving them to JSON file"""
+    resolutions = resolve_attendance_users(ops, resolver)
+    resolved_count = sum(1 for r in resolutions.values() if r.member_id is not None)
+    print(f"Resolved {resolved_count}/{len(resolutions)} attendance usernames")
+    with open("resolved_users.json", "w") as json_fd:
+        json_fd.write(resolutions_to_json(resolutions))
@@ -4,7 +4,7 @@ import os
 import sys
 from typing import Optional
 
-from zeusops_attendance_bot.api import Secret, get_client, run
+from zeusops_attendance_bot.api import DEFAULT_HTTP_HOST, Secret, get_client, run
 
 
 def parse_arguments(arguments: list[str]) -> argparse.Namespace:
@@ -15,7 +15,17 @@ def parse_arguments(arguments: list[str]) -> argparse.Namespace:
         epilog="API token requires envvar DISCORD_API_TOKEN",
     )
     parser.add_argument("--debug", action="store_true", help="Toggle debug mode")
-    parser.set_defaults(debug=False)
+    parser.add_argument(
+        "--http-port",
+        type=int,
+        help="Serve attendance as read-only HTTP API on this port (disabled if unset)",
+    )
+    parser.add_argument(
+        "--http-host",
+        help=f"Interface to serve the HTTP API on (default {DEFAULT_HTTP_HOST}). "
+        "Use 0.0.0.0 to expose it, like from a container",
+    )
+    parser.set_defaults(debug=False, http_port=None, http_host=DEFAULT_HTTP_HOST)
     return parser.parse_args(arguments)
 
 
@@ -31,10 +41,15 @@ def cli(arguments: Optional[list[str]] = None):
             file=sys.stderr,
         )
         exit(2)  # Simulate the argparse behaviour of exiting on bad args
-    main(token, args.debug)
+    main(token, args.debug, args.http_port, args.http_host)
 
 
-def main(token: Secret, debug: bool):
+def main(
+    token: Secret,
+    debug: bool,
+    http_port: Optional[int] = None,
+    http_host: str = DEFAULT_HTTP_HOST,
+):
     """Run the program's main command"""
-    client = get_client(debug_mode=debug)
+    client = get_client(debug_mode=debug, http_port=http_port, http_host=http_host)
     run(client, token)
@@ -1,53 +1,353 @@
 """Generate a sqlite database from the parsed attendance data"""
 
 
+import hashlib
 import json
+from collections import Counter
 from pathlib import Path
+from typing import Optional
 
 import sqlite_utils
 
-from zeusops_attendance_bot.models import OperationAttendance
+from zeusops_attendance_bot import preprocess
+from zeusops_attendance_bot.models import (
+    AttendanceMsg,
+    OperationAttendance,
+    attendance_to_json,
+)
+
+MESSAGES_FTS_COLUMNS = ["message", "author_display"]
+"""The raw message columns indexed for full-text search"""
+
+
+def create_table(db, name: str, columns: dict, **kwargs):
+    """Create a table if missing, else add any column it lacks (older versions)"""
+    table = db[name]
+    if not table.exists():
+        table.create(columns, **kwargs)
+        return
+    for column, column_type in columns.items():
+        if column not in table.columns_dict:
+            table.add_column(column, column_type)
 
 
 def create_tables(db):
-    """Create the DB tables for attendance"""
-    db["users"].create({"name": str}, pk="name")
-    db["operations"].create(
+    """Create the DB tables for attendance, upgrading those of older versions"""
+    create_table(db, "users", {"name": str}, pk="name")
+    create_table(
+        db,
+        "operations",
         {
             "date": str,
             "attendance_count": int,  # How many joined
+            "content_hash": str,  # Skips updating unchanged ops
         },
         pk="date",
     )
-    db["attendance"].create(
-        {"id": int, "operation_date": str, "user": str, "role": str},
+    create_table(
+        db,
+        "messages",
+        {
+            "id": int,
+            "operation_date": str,
+            "author_display": str,
+            "author_id": int,
+            "message": str,
+            "created_at": str,
+            "edited_at": str,
+            "flags": str,  # JSON list, see message_flags for lookups
+        },
+        pk="id",
+        foreign_keys=[("operation_date", "operations", "date")],
+    )
+    db["messages"].create_index(["operation_date"], if_not_exists=True)
+    db["messages"].create_index(["author_id"], if_not_exists=True)
+    db["messages"].create_index(["created_at"], if_not_exists=True)
+    if db["messages"].detect_fts() is None:
+        # Triggers keep the FTS5 index in sync with any later message change
+        db["messages"].enable_fts(MESSAGES_FTS_COLUMNS, create_triggers=True)
+    create_table(
+        db,
+        "message_flags",
+        {"message_id": int, "flag": str},
+        pk=("message_id", "flag"),
+        foreign_keys=[("message_id", "messages", "id")],
+    )
+    db["message_flags"].create_index(["flag"], if_not_exists=True)
+    create_table(
+        db,
+        "attendance",
+        {
+            "id": int,
+            "operation_date": str,
+            "message_id": int,
+            "user": str,
+            "role": str,
+        },
         # pk=("operation_date", "user"),
         pk=("id"),
         foreign_keys=[
             ("operation_date", "operations", "date"),
+            ("message_id", "messages", "id"),
             # ("user", "users", "name"),
         ],
     )
+    db["attendance"].create_index(["message_id"], if_not_exists=True)
+
+
+def message_row(msg: AttendanceMsg, op_date: Optional[str]) -> dict:
+    """Convert a raw (unsplit) attendance message to a messages table row"""
+    return {
+        "id": msg.id,
+        "operation_date": op_date,
+        "author_display": msg.author_display,
+        "author_id": msg.author_id,
+        "message": msg.message,
+        "created_at": msg.created_at.isoformat(),
+        "edited_at": msg.edited_at.isoformat() if msg.edited_at is not None else None,
+        "flags": json.dumps([flag.value for flag in msg.flags]),
+    }
+
+
+LineKey = tuple[Optional[int], str, int]
+"""Identity of an attendance row within an op: message ID, user, occurrence"""
+
+MESSAGE_COLUMNS = [
+    "id",
+    "operation_date",
+    "author_display",
+    "author_id",
+    "message",
+    "created_at",
+    "edited_at",
+    "flags",
+]
+"""Columns of the messages table, in message_row order"""
+
+
+def op_content_hash(
+    op: OperationAttendance, messages_by_id: Optional[dict[int, AttendanceMsg]]
+) -> str:
+    """Hash an op's parsed attendance and raw messages, to detect any change"""
+    op_date = op.op_date.isoformat()
+    raw_msgs = (
+        [
+            message_row(messages_by_id[msg_id], op_date)
+            for msg_id in op.message_ids
+            if msg_id in messages_by_id
+        ]
+        if messages_by_id is not None
+        else []
+    )
+    content = attendance_to_json([op]) + json.dumps(raw_msgs, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def attendance_rows(op: OperationAttendance) -> dict[LineKey, dict]:
+    """List the attendance rows of an op, by line identity"""
+    op_date = op.op_date.isoformat()
+    rows: dict[LineKey, dict] = {}
+    occurrences: Counter[tuple[Optional[int], str]] = Counter()
+    for squad_attendance in op.attendance:
+        for member, role in squad_attendance.members:
+            occurrences[(squad_attendance.message_id, member)] += 1
+            key = (
+                squad_attendance.message_id,
+                member,
+                occurrences[(squad_attendance.message_id, member)],
+            )
+            rows[key] = {
+                "operation_date": op_date,
+                "message_id": squad_attendance.message_id,
+                "user": member,
+                "role": squad_attendance.squad + " " + role
+                if role is not None
+                else squad_attendance.squad,
+            }
+    return rows
+
+
+def stored_attendance_rows(db, op_date: str) -> dict[LineKey, dict]:
+    """List the attendance rows stored for an op, by line identity"""
+    rows: dict[LineKey, dict] = {}
+    occurrences: Counter[tuple[Optional[int], str]] = Counter()
+    for row in db["attendance"].rows_where(
+        "operation_date = ?", [op_date], order_by="id"
+    ):
+        occurrences[(row["message_id"], row["user"])] += 1
+        key = (
+            row["message_id"],
+            row["user"],
+            occurrences[(row["message_id"], row["user"])],
+        )
+        rows[key] = row
+    return rows
+
+
+def sync_attendance(db, op: OperationAttendance, changes: Counter):
+    """Write only the attendance rows of an op that differ from stored ones"""
+    wanted = attendance_rows(op)
+    stored = stored_attendance_rows(db, op.op_date.isoformat())
+    for key, row in wanted.items():
+        stored_row = stored.get(key)
+        if stored_row is None:
+            db.execute(
+                "INSERT INTO attendance (operation_date, message_id, [user], role) "
+                "VALUES (:operation_date, :message_id, :user, :role)",
+                row,
+            )
+            changes["attendance_inserted"] += 1
+        elif stored_row["role"] != row["role"]:
+            db.execute(
+                "UPDATE attendance SET role = ? WHERE id = ?",
+                [row["role"], stored_row["id"]],
+            )
+            changes["attendance_updated"] += 1
+    for key in stored.keys() - wanted.keys():
+        db.execute("DELETE FROM attendance WHERE id = ?", [stored[key]["id"]])
+        changes["attendance_deleted"] += 1
+
+
+def sync_messages(db, wanted: list[dict], changes: Counter):
+    """
+    Write only the message rows differing from those stored, diffing by message ID
+
+    Diffing all messages at once, a message merely changing op is a single update
+    of its op date, whichever op it left or joined.
+    """
+    stored = {row["id"]: row for row in db["messages"].rows}
+    wanted_by_id = {row["id"]: row for row in wanted}
+    for msg_id, row in wanted_by_id.items():
+        stored_row = stored.get(msg_id)
+        if stored_row == row:
+            continue
+        relinked_row = (
+            {**stored_row, "operation_date": row["operation_date"]}
+            if stored_row is not None
+            else None
+        )
+        if relinked_row == row:  # Only the op changed
+            db.execute(
+                "UPDATE messages SET operation_date = ? WHERE id = ?",
+                [row["operation_date"], msg_id],
+            )
+            changes["messages_relinked"] += 1
+            continue
+        updates = ", ".join(f"{col} = excluded.{col}" for col in MESSAGE_COLUMNS[1:])
+        db.execute(
+            f"INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)}) "
+            f"VALUES ({', '.join(':' + col for col in MESSAGE_COLUMNS)}) "
+            f"ON CONFLICT(id) DO UPDATE SET {updates}",
+            row,
+        )
+        if stored_row is None or stored_row["flags"] != row["flags"]:
+            db.execute("DELETE FROM message_flags WHERE message_id = ?", [msg_id])
+            db.conn.executemany(
+                "INSERT INTO message_flags (message_id, flag) VALUES (?, ?)",
+                [(msg_id, flag) for flag in json.loads(row["flags"])],
+            )
+        changes["messages_inserted" if stored_row is None else "messages_updated"] += 1
+    for msg_id in stored.keys() - wanted_by_id.keys():
+        delete_message(db, msg_id)
+        changes["messages_deleted"] += 1
+
+
+def delete_message(db, msg_id: int):
+    """Delete a message, and its flags"""
+    db.execute("DELETE FROM message_flags WHERE message_id = ?", [msg_id])
+    db.execute("DELETE FROM messages WHERE id = ?", [msg_id])
+
+
+def sync_operation(db, op: OperationAttendance, content_hash: str, changes: Counter):
+    """Write a (new or changed) op, and its attendance rows"""
+    op_date = op.op_date.isoformat()
+    db.execute(
+        "INSERT INTO operations (date, attendance_count, content_hash) "
+        "VALUES (?, ?, ?) ON CONFLICT(date) DO UPDATE SET "
+        "attendance_count = excluded.attendance_count, "
+        "content_hash = excluded.content_hash",
+        [op_date, op.user_count, content_hash],
+    )
+    sync_attendance(db, op, changes)
+    changes["operations_synced"] += 1
+
+
+def delete_operation(db, op_date: str, changes: Counter):
+    """Delete an op no longer parsed, along with its attendance, unlinking messages"""
+    deleted = db.execute("DELETE FROM attendance WHERE operation_date = ?", [op_date])
+    changes["attendance_deleted"] += deleted.rowcount
+    unlinked = db.execute(
+        "UPDATE messages SET operation_date = NULL WHERE operation_date = ?",
+        [op_date],
+    )
+    changes["messages_relinked"] += unlinked.rowcount
+    db.execute("DELETE FROM operations WHERE date = ?", [op_date])
+    changes["operations_deleted"] += 1
+
+
+def check_unique_op_dates(ops: list[OperationAttendance]):
+    """Raise ValueError if any two ops share a date, as ops are stored by date"""
+    op_date_counts = Counter(op.op_date.isoformat() for op in ops)
+    duplicates = sorted(date for date, count in op_date_counts.items() if count > 1)
+    if duplicates:
+        raise ValueError(
+            f"Multiple ops parsed for the same date(s): {', '.join(duplicates)}. "
+            "Check the op separators and OP_DELIMITER flags around these dates"
+        )
+
+
+def update_operations(
+    db,
+    ops: list[OperationAttendance],
+    messages: Optional[list[AttendanceMsg]] = None,
+) -> Counter:
+    """
+    Bring the database in line with the given ops, in a single transaction
+
+    Ops whose content hash matches the stored one are skipped outright, others get
+    diffed row by row against what is stored, keyed by op date and line identity.
+    Raw messages are only synced if given.
+
+    Ops being keyed by date, two ops of the same date are refused up front.
+    """
+    check_unique_op_dates(ops)
+    changes: Counter = Counter()
+    messages_by_id = {msg.id: msg for msg in messages} if messages is not None else None
+    stored_hashes = {row["date"]: row["content_hash"] for row in db["operations"].rows}
+    op_dates = {op.op_date.isoformat() for op in ops}
+    with db.conn:
+        for op in ops:
+            content_hash = op_content_hash(op, messages_by_id)
+            if stored_hashes.get(op.op_date.isoformat()) == content_hash:
+                changes["operations_skipped"] += 1
+                continue
+            sync_operation(db, op, content_hash, changes)
+        for op_date in stored_hashes.keys() - op_dates:
+            delete_operation(db, op_date, changes)
+        if messages_by_id is not None:
+            # Messages outside of any op, like op separators, are linked to none
+            op_date_by_msg = {
+                msg_id: op.op_date.isoformat()
+                for op in ops
+                for msg_id in op.message_ids
+            }
+            wanted = [
+                message_row(msg, op_date_by_msg.get(msg_id))
+                for msg_id, msg in messages_by_id.items()
+            ]
+            sync_messages(db, wanted, changes)
+    return changes
 
 
-def populate(db_path, ops: list[OperationAttendance]):
-    """Populate the database of attendance"""
+def populate(
+    db_path,
+    ops: list[OperationAttendance],
+    messages: Optional[list[AttendanceMsg]] = None,
+) -> Counter:
+    """Populate the database of attendance, updating only what changed, if any"""
     db = sqlite_utils.Database(db_path)
     create_tables(db)
-    for op in ops:
-        op_date = op.op_date.isoformat()
-        db["operations"].insert({"date": op_date, "attendance_count": op.user_count})
-        for squad_attendance in op.attendance:
-            for member, role in squad_attendance.members:
-                db["attendance"].insert(
-                    {
-                        "operation_date": op_date,
-                        "user": member,
-                        "role": squad_attendance.squad + " " + role
-                        if role is not None
-                        else squad_attendance.squad,
-                    }
-                )
+    return update_operations(db, ops, messages)
 
 
 # Compare: 245 ops in #attendance chan = 245 rows in operations table
@@ -69,7 +369,9 @@ def populate(db_path, ops: list[OperationAttendance]):
 def main():
     """Save to database the data"""
     ops = load_attendance("parsed_attendance.json")
-    populate("attendance.db", ops)
+    messages = preprocess.load_attendance(Path("attendance.json"))
+    changes = populate("attendance.db", ops, messages)
+    print(f"Database updated: {dict(changes)}")
 
 
 def load_attendance(filename: Path) -> list[OperationAttendance]:
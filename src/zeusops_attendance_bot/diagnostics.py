@@ -0,0 +1,165 @@
+"""
+Collect attendance lines that failed parsing, for a single report at end of parsing
+
+Grouping failures by reason, op date and author gives moderators a short list of
+lines to fix (or flag as bad), instead of one stdout line per failure.
+"""
+
+import json
+import logging
+import time
+from datetime import date
+from enum import Enum
+from pathlib import Path
+from typing import Optional
+
+from pydantic import BaseModel
+from pydantic.json import pydantic_encoder
+
+from zeusops_attendance_bot.models import AttendanceMsg
+
+logger = logging.getLogger(__name__)
+
+MAX_SAMPLES: int = 3
+"""How many sample messages to keep per group of failures"""
+
+
+class ParseFailure(str, Enum):
+    """Why an attendance line was not parsed"""
+
+    BAD_FLAGGED = "BAD_FLAGGED"
+    """The message was flagged as bad via reaction emoji, skipped on purpose"""
+    NO_SQUAD_MATCH = "NO_SQUAD_MATCH"
+    """The message doesn't look like a squad's attendance line"""
+
+
+class FailureSample(BaseModel):
+    """A single message that failed parsing, as example"""
+
+    message_id: int
+    """Discord Message ID, to find the message back in the channel"""
+    message: str
+    """The message's (preprocessed) text"""
+
+
+class FailureGroup(BaseModel):
+    """All failures of one reason, in one op, by one author"""
+
+    reason: ParseFailure
+    op_date: date
+    author: str
+    """The display name of the messages' author"""
+    count: int = 0
+    """How many lines failed, samples included"""
+    samples: list[FailureSample] = []
+    """Up to MAX_SAMPLES of the failed messages"""
+
+
+FailureKey = tuple[ParseFailure, date, str]
+"""Grouping of failures: reason, op date, author"""
+
+
+class ParseDiagnostics:
+    """Aggregate parse failures, optionally logging them live, rate-limited"""
+
+    def __init__(self, live_log_interval: Optional[float] = None):
+        """
+        Initialize an empty report
+
+        Live logging of failures is off unless given the minimum interval (seconds)
+        between log lines, other failures being counted as suppressed.
+        """
+        self.groups: dict[FailureKey, FailureGroup] = {}
+        self.live_log_interval = live_log_interval
+        self.last_logged: Optional[float] = None
+        """Monotonic timestamp of the last live log line, if any"""
+        self.suppressed: int = 0
+        """How many failures were not live logged since last log line"""
+
+    def record(self, reason: ParseFailure, msg: AttendanceMsg, op_date: date):
+        """Record a message failing parsing"""
+        key = (reason, op_date, msg.author_display)
+        group = self.groups.get(key)
+        if group is None:
+            group = FailureGroup(reason=reason, op_date=op_date, author=key[2])
+            self.groups[key] = group
+        group.count += 1
+        if len(group.samples) < MAX_SAMPLES:
+            group.samples.append(FailureSample(message_id=msg.id, message=msg.message))
+        self.log_live(group, msg)
+
+    def log_live(self, group: FailureGroup, msg: AttendanceMsg):
+        """Log a failure, unless one was logged less than live_log_interval ago"""
+        if self.live_log_interval is None:
+            return
+        now = time.monotonic()
+        recently_logged = self.last_logged is not None and (
+            now - self.last_logged < self.live_log_interval
+        )
+        if recently_logged:
+            self.suppressed += 1
+            return
+        suppressed_note = (
+            f" ({self.suppressed} more suppressed)" if self.suppressed else ""
+        )
+        logger.warning(
+            f"{group.reason.value} on {group.op_date} by {group.author}. "
+            f"Message: '{msg.message}'{suppressed_note}"
+        )
+        self.last_logged = now
+        self.suppressed = 0
+
+    def flush(self):
+        """Log how many failures were suppressed since the last live log line"""
+        if self.live_log_interval is None or not self.suppressed:
+            return
+        logger.warning(f"{self.suppressed} more parse failures suppressed")
+        self.suppressed = 0
+
+    def count(self, reason: ParseFailure) -> int:
+        """Count how many lines failed parsing for the given reason"""
+        return sum(
+            group.count
+            for (group_reason, _, _), group in self.groups.items()
+            if group_reason == reason
+        )
+
+    @property
+    def failure_count(self) -> int:
+        """Count how many lines failed parsing, lines flagged bad not included"""
+        return sum(
+            group.count
+            for (reason, _, _), group in self.groups.items()
+            if reason != ParseFailure.BAD_FLAGGED
+        )
+
+    @property
+    def flagged_count(self) -> int:
+        """Count how many lines were skipped on purpose, being flagged bad"""
+        return self.count(ParseFailure.BAD_FLAGGED)
+
+    def report(self) -> list[FailureGroup]:
+        """List the failure groups, by reason then op date, then author"""
+        return [self.groups[key] for key in sorted(self.groups)]
+
+    def summary(self) -> str:
+        """Summarize the failures as one line per reason"""
+        per_reason: dict[ParseFailure, int] = {}
+        for (reason, _op_date, _author), group in self.groups.items():
+            per_reason[reason] = per_reason.get(reason, 0) + group.count
+        return "\n".join(
+            f"{reason.value}: {count} lines" for reason, count in per_reason.items()
+        )
+
+    def save(self, filename: Path):
+        """Write the full report to JSON file, once parsing is complete"""
+        self.flush()
+        with open(filename, "w") as json_fd:
+            json_fd.write(
+                json.dumps(
+                    self.report(),
+                    indent=2,
+                    ensure_ascii=False,
+                    default=pydantic_encoder,
+                )
+            )
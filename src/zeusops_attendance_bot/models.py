@@ -87,6 +87,8 @@ class SquadAttendance(BaseModel):
     """The squad for which attendance is being recorded for"""
     members: list[SquadMember]
     """The members of the squad, along with their potential role"""
+    message_id: Optional[int] = None
+    """The Discord Message ID this line of attendance was parsed from, if known"""
 
 
 class OperationAttendance(BaseModel):
@@ -94,6 +96,8 @@ class OperationAttendance(BaseModel):
 
     op_date: date
     attendance: list[SquadAttendance]
+    message_ids: list[int] = []
+    """The Discord Message IDs of every message of this op, parsed or not"""
 
     @property
     def user_count(self):
@@ -5,6 +5,7 @@ from datetime import date
 from pathlib import Path
 from typing import Optional
 
+from zeusops_attendance_bot.diagnostics import ParseDiagnostics, ParseFailure
 from zeusops_attendance_bot.models import (
     AttendanceFlag,
     AttendanceMsg,
@@ -67,7 +68,9 @@ def split_ops_delimiter(
         if abs(marker0 - marker1) > 1  # Skip multiple opseps
     ]
     first_op = [(0, opsep_locations[0])] if opsep_locations else []
-    last_op = [(opsep_locations[-1] + 1, len(sorted_attendance))]
+    # No separator at all: everything is (the end of) a single op
+    last_op_start = opsep_locations[-1] + 1 if opsep_locations else 0
+    last_op = [(last_op_start, len(sorted_attendance))]
     # Recover first + last message group too, as their own range
     all_op_ranges: list[Span] = [] + first_op + in_between_locs + last_op
     return [sorted_attendance[start:end] for start, end in all_op_ranges]
@@ -116,22 +119,28 @@ def split_ops(attendance_list: list[AttendanceMsg]) -> list[list[AttendanceMsg]]
     return ops
 
 
-def process_one_line(msg: AttendanceMsg, op_date: date) -> Optional[SquadAttendance]:
-    """Process a single attendance line, without context"""
+def process_one_line(
+    msg: AttendanceMsg,
+    op_date: date,
+    diagnostics: Optional[ParseDiagnostics] = None,
+) -> Optional[SquadAttendance]:
+    """Process a single attendance line, without context, recording any failure"""
     if AttendanceFlag.BAD in msg.flags:
-        # print(f"BADFLAGGED: Skipping message '{msg.message}'")
+        if diagnostics is not None:
+            diagnostics.record(ParseFailure.BAD_FLAGGED, msg, op_date)
         return None
     squad_match = re.fullmatch(REGEX_SQUAD, msg.message)
     if squad_match is None:
-        msg_author = msg.author_display
-        msg_text = msg.message
-        print(f"Bad squad match on {op_date} by {msg_author}. Message: '{msg_text}'")
+        if diagnostics is not None:
+            diagnostics.record(ParseFailure.NO_SQUAD_MATCH, msg, op_date)
         return None
     squad, squad_members = squad_match.groups()
-    return parse_squad_attendance(squad, squad_members)
+    return parse_squad_attendance(squad, squad_members, message_id=msg.id)
 
 
-def parse_squad_attendance(squad: str, attendance: str):
+def parse_squad_attendance(
+    squad: str, attendance: str, message_id: Optional[int] = None
+) -> SquadAttendance:
     """Parse a single squad's attendance"""
     members: list[SquadMember] = []
     # print(f"{squad=},{attendance=}")
@@ -141,7 +150,7 @@ def parse_squad_attendance(squad: str, attendance: str):
             role.replace("(", "").replace(")", "") if role is not None else None
         )
         members.append((username, role_noparen))
-    return SquadAttendance(squad=squad, members=members)
+    return SquadAttendance(squad=squad, members=members, message_id=message_id)
 
 
 def get_op_date(attendance: list[AttendanceMsg]) -> date:
@@ -154,34 +163,52 @@ def get_op_date(attendance: list[AttendanceMsg]) -> date:
 
 def parse_full_attendance_history(
     attendance_msgs: list[AttendanceMsg],
+    diagnostics: Optional[ParseDiagnostics] = None,
 ) -> list[OperationAttendance]:
     """Parse a preprocessed history into sequence of messages"""
     ops = split_ops(attendance_msgs)
-    all_ops_attendance: list[OperationAttendance] = []
-    for op_attendance in ops:
-        if not op_attendance:
-            continue  # Skip empty attendance
-        op_date = get_op_date(op_attendance)
-        op_parsed_attendance = []
-        for attendance_msg in op_attendance:
-            parsed = process_one_line(attendance_msg, op_date)
-            if parsed is None:
-                continue
-            op_parsed_attendance.append(parsed)
-        that_op = OperationAttendance(op_date=op_date, attendance=op_parsed_attendance)
-        all_ops_attendance.append(that_op)
-    return all_ops_attendance
+    return [
+        parse_one_op(op_attendance, diagnostics)
+        for op_attendance in ops
+        if op_attendance  # Skip empty attendance
+    ]
+
+
+def parse_one_op(
+    op_attendance: list[AttendanceMsg],
+    diagnostics: Optional[ParseDiagnostics] = None,
+) -> OperationAttendance:
+    """Parse the (non-empty) messages of a single op, already split from others"""
+    op_date = get_op_date(op_attendance)
+    op_parsed_attendance = []
+    for attendance_msg in op_attendance:
+        parsed = process_one_line(attendance_msg, op_date, diagnostics)
+        if parsed is None:
+            continue
+        op_parsed_attendance.append(parsed)
+    # Split messages share their ID: dedupe, preserving order
+    message_ids = list(dict.fromkeys(msg.id for msg in op_attendance))
+    return OperationAttendance(
+        op_date=op_date, attendance=op_parsed_attendance, message_ids=message_ids
+    )
 
 
 def main():
     """Parse the cleaned up attendance data"""
     attendance_msgs = load_attendance(Path("processed_attendance.json"))
-    all_ops = parse_full_attendance_history(attendance_msgs)
+    diagnostics = ParseDiagnostics()
+    all_ops = parse_full_attendance_history(attendance_msgs, diagnostics)
     with open("parsed_attendance.json", "w") as processed_fd:
         processed_fd.write(attendance_to_json(all_ops))
+    diagnostics.save(Path("parse_diagnostics.json"))
     for op in all_ops:
         print(
             f"[{op.op_date.isoformat()}] OP with {op.user_count} members, {len(op.attendance)} squads:"
         )
         for squad in op.attendance:
             print(squad)
+    print(
+        f"{diagnostics.failure_count} lines failed parsing, "
+        f"{diagnostics.flagged_count} skipped as flagged bad:"
+    )
+    print(diagnostics.summary())
@@ -42,9 +42,14 @@ def clean_bold(msg: AttendanceMsg) -> AttendanceMsg:
     return AttendanceMsg.new_from(msg, text, is_split=False)
 
 
+def preprocess_messages(messages: list[AttendanceMsg]) -> list[AttendanceMsg]:
+    """Split the given messages to lines, cleaning text of format, quietly"""
+    return [clean_bold(split) for split in newline_separate(messages)]
+
+
 def preprocess_history(messages: list[AttendanceMsg]) -> list[AttendanceMsg]:
     """Preprocess the given messages, splitting to line, cleaning text of format"""
-    preprocessed = [clean_bold(split) for split in newline_separate(messages)]
+    preprocessed = preprocess_messages(messages)
     print(f"{len(messages)} msgs input, processed into {len(preprocessed)}")
     return preprocessed
 
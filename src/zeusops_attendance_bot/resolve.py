@@ -0,0 +1,165 @@
+"""
+Resolve free-text attendance usernames to Discord member IDs
+
+Attendance lines name people by nickname ("Toll", "Angel"), not Discord ID. Match
+those against known names (guild member display names, historical message authors)
+via an inverted trigram index, so each lookup only scores the candidates sharing a
+trigram with the username, instead of comparing every pair of names.
+"""
+
+import json
+import re
+from collections import Counter, defaultdict
+from typing import Iterable, Optional
+
+from pydantic import BaseModel
+from pydantic.json import pydantic_encoder
+
+from zeusops_attendance_bot.models import AttendanceMsg, OperationAttendance, User
+
+MIN_CONFIDENCE: float = 0.5
+"""The minimum score for a username to be resolved to a member at all"""
+
+Trigram = str
+"""A three-character slice of a (padded, normalized) name"""
+
+
+class NameResolution(BaseModel):
+    """A parsed attendance username, resolved to a Discord member, if any"""
+
+    user: User
+    """The username as parsed from attendance"""
+    member_id: Optional[int]
+    """The Discord ID of the best-matching member, None if no good enough match"""
+    matched_name: Optional[str]
+    """The known name that matched the username best"""
+    confidence: float
+    """How similar the username and matched name are, from 0 to 1"""
+
+
+def normalize(name: str) -> str:
+    """Lowercase a name, dropping any non-alphanumeric character"""
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def trigrams(name: str) -> set[Trigram]:
+    """
+    Split a normalized name into trigrams, padded to also index its prefix
+
+    >>> sorted(trigrams("toll"))
+    ['  t', ' to', 'll ', 'oll', 'tol']
+    """
+    padded = f"  {name} "
+    return {"".join(chars) for chars in zip(padded, padded[1:], padded[2:])}
+
+
+def similarity(shared: int, query_size: int, candidate_size: int) -> float:
+    """
+    Score a match from its trigram counts: mean of containment and Dice coefficient
+
+    Containment rewards nicknames that are a part of a longer display name ("Toll" in
+    "tollmannd"), while Dice favours names of similar length (exact match = 1).
+    """
+    containment = shared / query_size
+    dice = 2 * shared / (query_size + candidate_size)
+    return (containment + dice) / 2
+
+
+class NameResolver:
+    """Match usernames to Discord member IDs, via a trigram index of known names"""
+
+    def __init__(self):
+        """Initialize an empty index"""
+        self.names: list[str] = []
+        """Every known (normalized) name, by index"""
+        self.known_names: set[str] = set()
+        """Same as names, for constant-time lookup of already-indexed names"""
+        self.name_trigrams: list[set[Trigram]] = []
+        """Trigrams of each known name, same indexing as names"""
+        self.member_ids: list[int] = []
+        """Discord member ID of each known name, same indexing as names"""
+        self.index: dict[Trigram, list[int]] = defaultdict(list)
+        """Inverted index: which known names contain a given trigram"""
+        self.cache: dict[str, NameResolution] = {}
+        """Resolutions already computed, by normalized username"""
+
+    def add(self, name: str, member_id: int):
+        """Add a known name for a member to the index. First name added wins ties"""
+        normalized = normalize(name)
+        if not normalized or normalized in self.known_names:
+            return
+        name_idx = len(self.names)
+        self.names.append(normalized)
+        self.known_names.add(normalized)
+        self.member_ids.append(member_id)
+        grams = trigrams(normalized)
+        self.name_trigrams.append(grams)
+        for gram in grams:
+            self.index[gram].append(name_idx)
+        self.cache.clear()  # New names may change previous resolutions
+
+    @classmethod
+    def from_history(
+        cls, members: dict[int, str], messages: Iterable[AttendanceMsg]
+    ) -> "NameResolver":
+        """Index guild members' display names, then historical author names"""
+        resolver = cls()
+        for member_id, display_name in members.items():
+            resolver.add(display_name, member_id)
+        for msg in messages:
+            resolver.add(msg.author_display, msg.author_id)
+        return resolver
+
+    def resolve(self, user: User) -> NameResolution:
+        """Find the member best matching the given username, caching the result"""
+        normalized = normalize(user)
+        if normalized not in self.cache:
+            self.cache[normalized] = self._resolve(normalized)
+        # Same resolution for all spellings, but reported for the name as given
+        return self.cache[normalized].copy(update={"user": user})
+
+    def _resolve(self, normalized: str) -> NameResolution:
+        """Score only the known names sharing a trigram with the normalized name"""
+        unresolved = NameResolution(
+            user=normalized, member_id=None, matched_name=None, confidence=0.0
+        )
+        query = trigrams(normalized)
+        shared_counts: Counter[int] = Counter()
+        for gram in query:
+            shared_counts.update(self.index.get(gram, []))
+        if not shared_counts:
+            return unresolved
+        best_idx, best_score = max(
+            (
+                (idx, similarity(shared, len(query), len(self.name_trigrams[idx])))
+                for idx, shared in shared_counts.items()
+            ),
+            key=lambda scored: (scored[1], -scored[0]),  # Ties: earliest added
+        )
+        if best_score < MIN_CONFIDENCE:
+            return unresolved
+        return NameResolution(
+            user=normalized,
+            member_id=self.member_ids[best_idx],
+            matched_name=self.names[best_idx],
+            confidence=round(best_score, 3),
+        )
+
+
+def resolve_attendance_users(
+    ops: list[OperationAttendance], resolver: NameResolver
+) -> dict[User, NameResolution]:
+    """Resolve every username seen in attendance, each unique name resolved once"""
+    return {
+        user: resolver.resolve(user)
+        for op in ops
+        for squad in op.attendance
+        for user, _role in squad.members
+    }
+
+
+def resolutions_to_json(resolutions: dict[User, NameResolution]) -> str:
+    """Export username resolutions to JSON string"""
+    return json.dumps(
+        resolutions, indent=2, ensure_ascii=False, default=pydantic_encoder
+    )
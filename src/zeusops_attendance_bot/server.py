@@ -0,0 +1,362 @@
+"""
+Read-only HTTP API over the bot's in-memory attendance
+
+Served from the same event loop as the discord client, via aiohttp (shipped with
+discord.py). Responses are cached with an ETag until new attendance comes in.
+Parsing is incremental: a new message only gets the op in progress re-parsed, and
+an edited one only the ops from its own onwards.
+"""
+
+import bisect
+import hashlib
+import json
+from collections import Counter
+from datetime import date, datetime
+from typing import Any, Callable, Iterator, Optional
+
+from aiohttp import web
+from pydantic import BaseModel
+from pydantic.json import pydantic_encoder
+
+from zeusops_attendance_bot.diagnostics import ParseDiagnostics
+from zeusops_attendance_bot.models import AttendanceMsg, OperationAttendance, User
+from zeusops_attendance_bot.parsing import parse_one_op, split_ops
+from zeusops_attendance_bot.preprocess import preprocess_messages
+
+DEFAULT_RECENT_OPS: int = 10
+"""How many ops to list on /ops when no limit is given"""
+
+CacheKey = tuple
+"""A route name, followed by its normalized parameters, like ("ops", 10)"""
+
+
+class UserSummary(BaseModel):
+    """A Zeusops user's attendance record, across all ops"""
+
+    user: User
+    ops_attended: int
+    """How many ops the user appears in"""
+    last_op: date
+    """The date of the latest op the user attended"""
+    roles: dict[str, int]
+    """How many times the user held each squad role"""
+
+
+class AttendanceState:
+    """
+    The attendance messages heard by the bot, parsed incrementally
+
+    Ops followed by a separator (or a new op) can't be changed by new messages, so
+    they are parsed once, "settled". New messages only get the trailing op, the one
+    still being posted, parsed again. Edited, deleted or (un)flagged messages get
+    parsing resumed from the op before theirs, as they may merge or split ops.
+    """
+
+    def __init__(self):
+        """Initialize an empty state"""
+        self.version: int = 0
+        """Incremented on any change to messages, invalidating cached results"""
+        self.messages: dict[int, AttendanceMsg] = {}
+        """Raw messages, by Discord message ID"""
+        self.sorted_messages: list[AttendanceMsg] = []
+        """Same raw messages, by timestamp then ID, to find those after a given time"""
+        self.live_messages: list[AttendanceMsg] = []
+        """Messages heard live since last reset, kept for the next reset"""
+        self.settled_ops: list[OperationAttendance] = []
+        """Ops parsed once and for all, oldest first"""
+        self.settled_starts: list[datetime] = []
+        """Timestamp of each settled op's first line, same indexing as settled_ops"""
+        self.parse_from: Optional[datetime] = None
+        """Timestamp of the first message after settled ops, None for all messages"""
+        self._tail_ops: Optional[list[OperationAttendance]] = None
+        self.user_dates: dict[User, Counter[date]] = {}
+        """Dates of settled ops each user attended (counted, to unsettle ops)"""
+        self.user_roles: dict[User, Counter[str]] = {}
+        """Roles each user held in settled ops"""
+
+    def reset(
+        self,
+        messages: list[AttendanceMsg],
+        diagnostics: Optional[ParseDiagnostics] = None,
+    ):
+        """
+        Replace the whole history of messages, like on (re)connection, parsing it
+
+        Messages heard live while grabbing that history, and missing from it, are
+        kept. Parse failures of the history are recorded to diagnostics, if given.
+        """
+        history_ids = {msg.id for msg in messages}
+        latest = max((msg.created_at for msg in messages), default=None)
+        live = [
+            msg
+            for msg in self.live_messages
+            if msg.id not in history_ids and (latest is None or msg.created_at > latest)
+        ]
+        self.live_messages = []
+        self.messages = {msg.id: msg for msg in list(messages) + live}
+        self.sorted_messages = sorted(self.messages.values(), key=message_sort_key)
+        self.settled_ops = []
+        self.settled_starts = []
+        self.parse_from = None
+        self.user_dates = {}
+        self.user_roles = {}
+        self.settle(diagnostics)
+        self.version += 1
+
+    def add(self, message: AttendanceMsg):
+        """Record a new attendance message, to be parsed on next access"""
+        self.live_messages.append(message)
+        self.replace(message)
+
+    def replace(self, message: AttendanceMsg):
+        """Record an edited (or re-flagged) message, adding it if unknown"""
+        self._forget(message.id)
+        self.messages[message.id] = message
+        bisect.insort(self.sorted_messages, message, key=message_sort_key)
+        self.unsettle_from(message.created_at)
+
+    def remove(self, message_id: int):
+        """Forget a deleted message, if known"""
+        removed = self._forget(message_id)
+        if removed is not None:
+            self.unsettle_from(removed.created_at)
+
+    def _forget(self, message_id: int) -> Optional[AttendanceMsg]:
+        """Drop a message from both raw message collections, returning it"""
+        message = self.messages.pop(message_id, None)
+        if message is not None:
+            idx = bisect.bisect_left(
+                self.sorted_messages,
+                message_sort_key(message),
+                key=message_sort_key,
+            )
+            del self.sorted_messages[idx]
+        return message
+
+    def unsettle_from(self, changed_at: datetime):
+        """
+        Mark ops needing a re-parse after a change to a message of given timestamp
+
+        Changes past the start of the op in progress only need that op re-parsed.
+        Otherwise, the op the message is in gets unsettled along with every later op,
+        and so does the op before it, as a removed separator (or new-op flag) merges
+        the two.
+        """
+        if self.parse_from is None or changed_at <= self.parse_from:
+            first_unsettled = max(
+                bisect.bisect_left(self.settled_starts, changed_at) - 1, 0
+            )
+            for op in self.settled_ops[first_unsettled:]:
+                forget_op_users(op, self.user_dates, self.user_roles)
+            # The first op may be preceded by lines of no op: parse all from start
+            self.parse_from = (
+                self.settled_starts[first_unsettled] if first_unsettled else None
+            )
+            del self.settled_ops[first_unsettled:]
+            del self.settled_starts[first_unsettled:]
+        self._tail_ops = None
+        self.version += 1
+
+    def settle(self, diagnostics: Optional[ParseDiagnostics] = None):
+        """Parse messages past settled ops, settling every op but the last one"""
+        first_unsettled = (
+            0
+            if self.parse_from is None
+            else bisect.bisect_left(
+                self.sorted_messages,
+                (self.parse_from, 0),
+                key=message_sort_key,
+            )
+        )
+        lines = preprocess_messages(self.sorted_messages[first_unsettled:])
+        *finished, tail_lines = split_ops(lines)
+        for op_lines in finished:
+            if not op_lines:
+                continue
+            op = parse_one_op(op_lines, diagnostics)
+            self.settled_ops.append(op)
+            self.settled_starts.append(op_lines[0].created_at)
+            record_op_users(op, self.user_dates, self.user_roles)
+        if tail_lines:
+            self.parse_from = tail_lines[0].created_at
+        elif lines:  # Ends on a separator: resume from it
+            self.parse_from = lines[-1].created_at
+        self._tail_ops = [parse_one_op(tail_lines, diagnostics)] if tail_lines else []
+
+    @property
+    def tail_ops(self) -> list[OperationAttendance]:
+        """Get the op still being posted, if any, parsing changed messages if needed"""
+        if self._tail_ops is None:
+            self.settle()
+        return self._tail_ops or []
+
+    @property
+    def ops(self) -> list[OperationAttendance]:
+        """Get all ops parsed from messages, oldest first"""
+        tail_ops = self.tail_ops
+        return self.settled_ops + tail_ops
+
+    @property
+    def op_count(self) -> int:
+        """Count how many ops were parsed"""
+        tail_ops = self.tail_ops
+        return len(self.settled_ops) + len(tail_ops)
+
+    def latest_ops(self, limit: int) -> list[OperationAttendance]:
+        """Get the latest ops, newest first, without copying all ops"""
+        newest = self.tail_ops[::-1][:limit]
+        remaining = limit - len(newest)
+        if remaining > 0:
+            newest += self.settled_ops[-remaining:][::-1]
+        return newest
+
+    def user_summary(self, user: User) -> Optional[UserSummary]:
+        """Summarize a user's attendance across all ops, None if never attended"""
+        tail_dates: dict[User, Counter[date]] = {}
+        tail_roles: dict[User, Counter[str]] = {}
+        for op in self.tail_ops:
+            record_op_users(op, tail_dates, tail_roles)
+        dates = self.user_dates.get(user, Counter()) + tail_dates.get(user, Counter())
+        if not dates:
+            return None
+        roles = self.user_roles.get(user, Counter()) + tail_roles.get(user, Counter())
+        return UserSummary(
+            user=user, ops_attended=len(dates), last_op=max(dates), roles=dict(roles)
+        )
+
+
+def message_sort_key(message: AttendanceMsg) -> tuple[datetime, int]:
+    """Order messages by timestamp, then ID for messages sent at the same time"""
+    return message.created_at, message.id
+
+
+def op_user_roles(op: OperationAttendance) -> Iterator[tuple[User, str]]:
+    """List each user of an op's attendance, along with their squad role"""
+    for squad in op.attendance:
+        for member, role in squad.members:
+            squad_role = squad.squad + " " + role if role is not None else squad.squad
+            yield member.strip(), squad_role
+
+
+def record_op_users(
+    op: OperationAttendance,
+    user_dates: dict[User, Counter[date]],
+    user_roles: dict[User, Counter[str]],
+):
+    """Add an op's attendance to each user's attended op dates and roles held"""
+    for user, squad_role in op_user_roles(op):
+        user_dates.setdefault(user, Counter())[op.op_date] += 1
+        user_roles.setdefault(user, Counter())[squad_role] += 1
+
+
+def forget_op_users(
+    op: OperationAttendance,
+    user_dates: dict[User, Counter[date]],
+    user_roles: dict[User, Counter[str]],
+):
+    """Remove an op's attendance from users' op dates and roles, undoing a record"""
+    for user, squad_role in op_user_roles(op):
+        user_dates[user][op.op_date] -= 1
+        user_roles[user][squad_role] -= 1
+        if not +user_dates[user]:
+            del user_dates[user]
+            del user_roles[user]
+
+
+class AttendanceServer:
+    """HTTP routes over an attendance state, caching responses per state version"""
+
+    def __init__(self, state: AttendanceState):
+        """Set up the routes"""
+        self.state = state
+        self.cache: dict[CacheKey, Optional[tuple[str, bytes]]] = {}
+        """Response ETag and body, by route and its (normalized) parameters
+
+        None when the computation found nothing, cached as such: replying 404."""
+        self.cache_version: int = state.version
+        """The state version the cached responses were computed at"""
+        self.app = web.Application()
+        self.app.add_routes(
+            [
+                web.get("/ops/current", self.current_op),
+                web.get("/ops", self.recent_ops),
+                web.get("/users/{user}", self.user_summary),
+            ]
+        )
+        self.runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str, port: int):
+        """Start serving, in the running event loop"""
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        print(f"Serving attendance API on http://{host}:{port}")
+
+    async def stop(self):
+        """Stop serving"""
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def respond(
+        self,
+        request: web.Request,
+        key: CacheKey,
+        compute: Callable[[], Any],
+        not_found: str = "Not found",
+    ) -> web.Response:
+        """
+        Reply with cached JSON if state unchanged, 304 if client has it already
+
+        Computing None replies 404 with the not_found text, also until state changes.
+        """
+        if self.cache_version != self.state.version:
+            self.cache.clear()
+            self.cache_version = self.state.version
+        if key not in self.cache:
+            self.cache[key] = self.encode(compute())
+        cached = self.cache[key]
+        if cached is None:
+            raise web.HTTPNotFound(text=not_found)
+        etag, body = cached
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="application/json", headers=headers)
+
+    def encode(self, result: Any) -> Optional[tuple[str, bytes]]:
+        """Encode a result to JSON, tagged with state version and body hash"""
+        if result is None:
+            return None
+        body = json.dumps(result, ensure_ascii=False, default=pydantic_encoder).encode()
+        etag = f'"{self.state.version}-{hashlib.sha1(body).hexdigest()[:16]}"'
+        return etag, body
+
+    async def current_op(self, request: web.Request) -> web.Response:
+        """Get the latest op's attendance"""
+        if not self.state.op_count:
+            raise web.HTTPNotFound(text="No op attendance yet")
+        return self.respond(request, ("current",), lambda: self.state.latest_ops(1)[0])
+
+    async def recent_ops(self, request: web.Request) -> web.Response:
+        """Get the latest ops' attendance, newest first"""
+        try:
+            limit = int(request.query.get("limit", DEFAULT_RECENT_OPS))
+        except ValueError:
+            raise web.HTTPBadRequest(text="limit must be an integer")
+        if limit < 1:
+            raise web.HTTPBadRequest(text="limit must be positive")
+        # Any limit past the op count gives the same reply: cache it once
+        limit = min(limit, self.state.op_count)
+        return self.respond(
+            request, ("ops", limit), lambda: self.state.latest_ops(limit)
+        )
+
+    async def user_summary(self, request: web.Request) -> web.Response:
+        """Get a single user's attendance summary"""
+        user = request.match_info["user"]
+        return self.respond(
+            request,
+            ("user", user),
+            lambda: self.state.user_summary(user),
+            not_found=f"No attendance for user {user}",
+        )
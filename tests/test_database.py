@@ -0,0 +1,224 @@
+"""Check the attendance database is built as expected"""
+
+import pytest
+import sqlite_utils
+
+from tests.attendance_messages import RAW_MSGS, SEPARATOR_MSG, SPLIT_INDEX, msgs_obj
+from zeusops_attendance_bot.database import populate
+from zeusops_attendance_bot.models import AttendanceFlag
+from zeusops_attendance_bot.parsing import parse_full_attendance_history
+
+
+def test_messages_fulltext_search(tmp_path):
+    """Check raw messages are searchable, linked to op and parsed attendance"""
+    # Given a parsed attendance history
+    ops = parse_full_attendance_history([SEPARATOR_MSG] + msgs_obj)
+    # When I populate a database with it, along with the raw messages
+    db_path = tmp_path / "attendance.db"
+    populate(db_path, ops, RAW_MSGS)
+    db = sqlite_utils.Database(db_path)
+    # Then searching messages for a name finds the lines mentioning it
+    found = list(db["messages"].search("Pixy"))
+    assert {row["author_display"] for row in found} == {
+        "Solo Wing Pixy"
+    }, "Should find Pixy's attendance lines"
+    # And the found messages are linked to their operation
+    assert {row["operation_date"] for row in found} == {
+        "2022-05-21",
+        "2022-05-22",
+    }, "Messages should be linked to their op"
+    # And the parsed attendance links back to the message it came from
+    pixy_msg_ids = {row["id"] for row in found}
+    attendance_users = {
+        row["user"]
+        for row in db["attendance"].rows_where(
+            "message_id in ({})".format(",".join("?" * len(pixy_msg_ids))),
+            list(pixy_msg_ids),
+        )
+    }
+    assert "Pixy" in attendance_users, "Attendance should link to source message"
+
+
+def test_populate_existing_db_unchanged(tmp_path):
+    """Check re-populating a database with the same ops writes nothing"""
+    # Given a database populated with parsed attendance
+    ops = parse_full_attendance_history([SEPARATOR_MSG] + msgs_obj)
+    db_path = tmp_path / "attendance.db"
+    populate(db_path, ops, RAW_MSGS)
+    # When I populate it again with the same data
+    changes = populate(db_path, ops, RAW_MSGS)
+    # Then every op is skipped, nothing written
+    assert changes == {"operations_skipped": len(ops)}, "Nothing should be written"
+
+
+def test_populate_updates_only_changed_op(tmp_path):
+    """Check a corrected attendance line only rewrites that op's changed rows"""
+    # Given a database populated with parsed attendance
+    ops = parse_full_attendance_history([SEPARATOR_MSG] + msgs_obj)
+    db_path = tmp_path / "attendance.db"
+    populate(db_path, ops, RAW_MSGS)
+    # And a correction to one line of the last op
+    fixed_msg = msgs_obj[-1].new_from("HQCO: Pixy(Mod), Barr", is_split=False)
+    fixed_msgs = msgs_obj[:-1] + [fixed_msg]
+    fixed_raw = [fixed_msg if msg.id == fixed_msg.id else msg for msg in RAW_MSGS]
+    # When I populate the database with the corrected data
+    fixed_ops = parse_full_attendance_history([SEPARATOR_MSG] + fixed_msgs)
+    changes = populate(db_path, fixed_ops, fixed_raw)
+    # Then only the corrected op is written, a single attendance row added
+    assert changes == {
+        "operations_skipped": 1,
+        "operations_synced": 1,
+        "attendance_inserted": 1,
+        "messages_updated": 1,
+    }, "Only the corrected line should be written"
+    # And the search index sees the corrected message
+    db = sqlite_utils.Database(db_path)
+    found = list(db["messages"].search("Barr"))
+    assert fixed_msg.id in {row["id"] for row in found}, "FTS should be updated"
+    last_op_rows = db["attendance"].count_where("operation_date = ?", ["2022-05-22"])
+    assert last_op_rows == fixed_ops[-1].user_count, "Op rows should match parsing"
+
+
+def populate_edited(db_path, edits: dict) -> dict:
+    """Populate the database with messages edited, by index in msgs_obj"""
+    edited_msgs = [edits.get(idx, msg) for idx, msg in enumerate(msgs_obj)]
+    edited_by_id = {msg.id: msg for msg in edits.values()}
+    edited_raw = [edited_by_id.get(msg.id, msg) for msg in RAW_MSGS]
+    edited_ops = parse_full_attendance_history([SEPARATOR_MSG] + edited_msgs)
+    return populate(db_path, edited_ops, edited_raw)
+
+
+@pytest.fixture
+def populated_db(tmp_path):
+    """A database populated with the parsed attendance, returned as its path"""
+    ops = parse_full_attendance_history([SEPARATOR_MSG] + msgs_obj)
+    db_path = tmp_path / "attendance.db"
+    populate(db_path, ops, RAW_MSGS)
+    return db_path
+
+
+def test_populate_updates_changed_role(populated_db):
+    """Check a changed role updates the attendance row in place"""
+    # Given a database populated with parsed attendance
+    # When a role is corrected in the last op
+    fixed_msg = msgs_obj[-1].new_from("HQCO: Pixy(Zeus)", is_split=False)
+    changes = populate_edited(populated_db, {len(msgs_obj) - 1: fixed_msg})
+    # Then the attendance row is updated, not replaced
+    assert changes == {
+        "operations_skipped": 1,
+        "operations_synced": 1,
+        "attendance_updated": 1,
+        "messages_updated": 1,
+    }, "Only the role should be updated"
+    db = sqlite_utils.Database(populated_db)
+    (pixy_row,) = db["attendance"].rows_where("message_id = ?", [fixed_msg.id])
+    assert pixy_row["role"] == "HQCO Zeus"
+
+
+def test_populate_deletes_removed_member(populated_db):
+    """Check a member removed from a line gets its attendance row deleted"""
+    # Given a database populated with parsed attendance
+    # When a member is removed from a line of the last op
+    fixed_msg = msgs_obj[-2].new_from("HQ1PLT: Goose (L)", is_split=False)
+    changes = populate_edited(populated_db, {len(msgs_obj) - 2: fixed_msg})
+    # Then only that member's attendance row is deleted
+    assert changes["attendance_deleted"] == 1, "Removed member should be deleted"
+    assert "attendance_inserted" not in changes, "Nothing should be reinserted"
+    db = sqlite_utils.Database(populated_db)
+    users = {
+        row["user"]
+        for row in db["attendance"].rows_where("message_id = ?", [fixed_msg.id])
+    }
+    assert users == {"Goose "}, "Only the remaining member should be stored"
+
+
+def test_populate_deletes_removed_op(populated_db):
+    """Check an op no longer parsed is deleted, along with its rows"""
+    # Given a database populated with parsed attendance
+    ops = parse_full_attendance_history([SEPARATOR_MSG] + msgs_obj)
+    # When I populate it with the first op only
+    changes = populate(populated_db, ops[:1], RAW_MSGS)
+    # Then the last op and its attendance are deleted
+    assert changes["operations_deleted"] == 1, "Removed op should be deleted"
+    assert changes["attendance_deleted"] == ops[-1].user_count
+    db = sqlite_utils.Database(populated_db)
+    assert [row["date"] for row in db["operations"].rows] == ["2022-05-21"]
+    assert not db["attendance"].count_where("operation_date = ?", ["2022-05-22"])
+    # And its messages are kept, but linked to no op
+    assert "messages_deleted" not in changes, "Messages shouldn't be deleted"
+    assert "messages_inserted" not in changes, "Messages shouldn't be reinserted"
+    assert db["messages"].count == len(RAW_MSGS), "Messages shouldn't be lost"
+    assert not db["messages"].count_where("operation_date = ?", ["2022-05-22"])
+
+
+def test_populate_moves_message_between_ops(populated_db):
+    """Check a message changing op gets relinked, with its attendance"""
+    # Given a database populated with parsed attendance
+    # When the new-op flag is moved one message later
+    unflagged = msgs_obj[SPLIT_INDEX].copy(update={"flags": []})
+    flagged = msgs_obj[SPLIT_INDEX + 1].copy(
+        update={"flags": [AttendanceFlag.OP_DELIMITER]}
+    )
+    populate_edited(populated_db, {SPLIT_INDEX: unflagged, SPLIT_INDEX + 1: flagged})
+    # Then the previously flagged message is linked to the previous op
+    db = sqlite_utils.Database(populated_db)
+    assert db["messages"].get(unflagged.id)["operation_date"] == "2022-05-21"
+    op_dates = {
+        row["operation_date"]
+        for row in db["attendance"].rows_where("message_id = ?", [unflagged.id])
+    }
+    assert op_dates == {"2022-05-21"}, "Attendance should move along its message"
+
+
+def test_populate_refuses_duplicate_op_dates(populated_db):
+    """Check two ops of the same date are refused, rather than overwritten"""
+    # Given a database populated with parsed attendance
+    # When a new-op flag splits the first op in two, on the same date
+    flagged = msgs_obj[3].copy(update={"flags": [AttendanceFlag.OP_DELIMITER]})
+    # Then populating fails, naming the duplicate date
+    with pytest.raises(ValueError, match="2022-05-21"):
+        populate_edited(populated_db, {3: flagged})
+    # And the stored attendance is untouched
+    db = sqlite_utils.Database(populated_db)
+    assert db["attendance"].count_where("operation_date = ?", ["2022-05-21"])
+
+
+def test_populate_upgrades_older_database(tmp_path):
+    """Check a database built by an older version gets upgraded in place"""
+    # Given a database with the schema of older versions
+    db_path = tmp_path / "attendance.db"
+    db = sqlite_utils.Database(db_path)
+    db["users"].create({"name": str}, pk="name")
+    db["operations"].create({"date": str, "attendance_count": int}, pk="date")
+    db["attendance"].create(
+        {"id": int, "operation_date": str, "user": str, "role": str},
+        pk="id",
+        foreign_keys=[("operation_date", "operations", "date")],
+    )
+    # When I populate it
+    ops = parse_full_attendance_history([SEPARATOR_MSG] + msgs_obj)
+    populate(db_path, ops, RAW_MSGS)
+    # Then the missing tables and columns are added
+    assert "content_hash" in db["operations"].columns_dict
+    assert "message_id" in db["attendance"].columns_dict
+    assert list(db["messages"].search("Pixy")), "Messages should be searchable"
+    # And populating again skips every op
+    changes = populate(db_path, ops, RAW_MSGS)
+    assert changes == {"operations_skipped": len(ops)}
+
+
+def test_populate_relinks_unchanged_messages(populated_db):
+    """Check messages merely changing op only get their op updated"""
+    # Given a database populated with parsed attendance
+    # When the new-op flag is removed, merging the last op into the first
+    unflagged = msgs_obj[SPLIT_INDEX].copy(update={"flags": []})
+    changes = populate_edited(populated_db, {SPLIT_INDEX: unflagged})
+    # Then only the unflagged message is rewritten, others are relinked
+    assert changes["messages_updated"] == 1, "Unflagged message should be updated"
+    assert changes["messages_relinked"], "Other messages should be relinked"
+    assert "messages_deleted" not in changes, "Messages shouldn't be deleted"
+    assert "messages_inserted" not in changes, "Messages shouldn't be reinserted"
+    # And every message of the merged op is linked to it
+    db = sqlite_utils.Database(populated_db)
+    assert not db["messages"].count_where("operation_date = ?", ["2022-05-22"])
+    assert db["message_flags"].count == 0, "Flag rows should follow the message"
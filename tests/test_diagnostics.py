@@ -0,0 +1,55 @@
+"""Check parse failures get aggregated into a report"""
+
+from datetime import date
+
+from tests.attendance_messages import msgs_obj
+from zeusops_attendance_bot.diagnostics import ParseDiagnostics, ParseFailure
+from zeusops_attendance_bot.models import AttendanceFlag
+from zeusops_attendance_bot.parsing import process_one_line
+
+OP_DATE = date(2022, 5, 21)
+
+
+def test_failures_grouped_with_samples(capsys):
+    """Check failing lines are grouped by reason/date/author, and not printed"""
+    # Given a diagnostics report
+    diagnostics = ParseDiagnostics()
+    # And many unparseable lines from the same author
+    junk_msgs = [msgs_obj[0].new_from(f"Sorry late!!! #{i}") for i in range(5)]
+    # And a line flagged as bad
+    flagged_msg = msgs_obj[1].copy(update={"flags": [AttendanceFlag.BAD]})
+    # When I process these lines
+    for msg in junk_msgs + [flagged_msg]:
+        assert process_one_line(msg, OP_DATE, diagnostics) is None
+    # Then nothing is printed
+    assert not capsys.readouterr().out, "Failures shouldn't be printed"
+    # And the failures are grouped by reason, date, author
+    flagged, no_match = diagnostics.report()
+    assert flagged.reason == ParseFailure.BAD_FLAGGED
+    assert no_match.reason == ParseFailure.NO_SQUAD_MATCH
+    assert no_match.author == "tollmannd", "Grouped by author"
+    assert no_match.count == 5, "All failures should be counted"
+    # And only a few sample messages are kept
+    assert len(no_match.samples) == 3, "Samples should be capped"
+    # And lines flagged bad are counted apart from failures
+    assert diagnostics.failure_count == 5, "Flagged lines aren't failures"
+    assert diagnostics.flagged_count == 1
+
+
+def test_live_logging_rate_limited(caplog):
+    """Check live logging of failures is rate-limited"""
+    # Given a diagnostics report logging live, at most once a minute
+    diagnostics = ParseDiagnostics(live_log_interval=60)
+    # When many lines fail parsing in a burst
+    for i in range(10):
+        msg = msgs_obj[0].new_from(f"Sorry late!!! #{i}")
+        process_one_line(msg, OP_DATE, diagnostics)
+    # Then only the first failure is logged
+    assert len(caplog.records) == 1, "Live logging should be rate-limited"
+    # And the others are counted as suppressed
+    assert diagnostics.suppressed == 9
+    # And flushing reports the suppressed failures
+    diagnostics.flush()
+    assert len(caplog.records) == 2, "Flush should log the suppressed count"
+    assert "9 more" in caplog.records[-1].getMessage()
+    assert diagnostics.suppressed == 0, "Flush should reset suppressed count"
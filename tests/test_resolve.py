@@ -0,0 +1,62 @@
+"""Check attendance usernames resolve to the right Discord member"""
+
+from tests.attendance_messages import msgs_obj
+from zeusops_attendance_bot.api import get_client
+from zeusops_attendance_bot.resolve import NameResolver
+
+MEMBERS = {
+    266696844065636350: "tollmannd",
+    344685908311670800: "MikeAngel",
+    319101566227578900: "Better Goose",
+}
+"""Guild members, as display name by Discord ID"""
+
+
+def test_resolve_nickname_to_member():
+    """Check nicknames resolve to the member whose display name contains it"""
+    # Given a resolver indexing guild members and message authors
+    resolver = NameResolver.from_history(MEMBERS, msgs_obj)
+    # When I resolve nicknames seen in attendance
+    toll = resolver.resolve("Toll")
+    angel = resolver.resolve("Angel")
+    goose = resolver.resolve("Goose ")
+    # Then each resolves to the right member, confidently
+    assert toll.member_id == 266696844065636350, "Toll should be tollmannd"
+    assert angel.member_id == 344685908311670800, "Angel should be MikeAngel"
+    assert goose.member_id == 319101566227578900, "Goose should be Better Goose"
+    assert toll.confidence >= 0.5, "Resolution should be confident"
+
+
+def test_resolve_unknown_name():
+    """Check unknown names stay unresolved, and get cached"""
+    # Given a resolver indexing guild members
+    resolver = NameResolver.from_history(MEMBERS, [])
+    # When I resolve a name unlike any member
+    resolution = resolver.resolve("Xyz")
+    # Then no member matches
+    assert resolution.member_id is None, "Unknown name shouldn't resolve"
+    # And resolving it again hits the cache
+    assert resolver.resolve("Xyz") == resolution, "Resolution should be cached"
+    assert list(resolver.cache) == ["xyz"], "Cache should be by normalized name"
+
+
+def test_resolve_spellings_once(mocker):
+    """Check spellings of the same name get resolved once, reported as given"""
+    # Given a resolver indexing guild members
+    resolver = NameResolver.from_history(MEMBERS, [])
+    scorer = mocker.spy(resolver, "_resolve")
+    # When I resolve the same name spelled differently
+    resolutions = [resolver.resolve(name) for name in ["Goose", "Goose ", "goose"]]
+    # Then the name is only scored once
+    assert scorer.call_count == 1, "Spellings should share a cache entry"
+    # And each resolution reports the name as given
+    assert [r.user for r in resolutions] == ["Goose", "Goose ", "goose"]
+    assert {r.member_id for r in resolutions} == {319101566227578900}
+
+
+def test_client_requests_members_intent():
+    """Check the client can list all members, for resolution to use them"""
+    # When I get a discord client
+    client = get_client(debug_mode=False)
+    # Then it requests the (privileged) members intent
+    assert client.intents.members, "Members intent needed to list channel members"
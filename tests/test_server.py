@@ -0,0 +1,195 @@
+"""Check the HTTP API serves the in-memory attendance, cached"""
+
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from tests.attendance_messages import RAW_MSGS, SEPARATOR_MSG, SPLIT_INDEX, msgs_obj
+from zeusops_attendance_bot.models import AttendanceFlag, AttendanceMsg
+from zeusops_attendance_bot.parsing import parse_full_attendance_history
+from zeusops_attendance_bot.preprocess import preprocess_messages
+from zeusops_attendance_bot.server import AttendanceServer, AttendanceState
+
+
+def new_message(text: str, msg_id: int = 1) -> AttendanceMsg:
+    """Create a message posted after the whole history, with the given text"""
+    new_msg = msgs_obj[-1].copy(
+        update={"id": msg_id, "message": text, "is_split": False}
+    )
+    new_msg.created_at = new_msg.created_at.replace(year=2023)
+    return new_msg
+
+
+async def query_api(state: AttendanceState):
+    """Query the API over given state, adding a message between two requests"""
+    server = AttendanceServer(state)
+    async with TestClient(TestServer(server.app)) as client:
+        current = await client.get("/ops/current")
+        current_json = await current.json()
+        etag = current.headers["ETag"]
+        cached = await client.get("/ops/current", headers={"If-None-Match": etag})
+        user = await client.get("/users/Pixy")
+        user_json = await user.json()
+        state.add(new_message("HQ2PLT: Newbie"))
+        refreshed = await client.get("/ops/current", headers={"If-None-Match": etag})
+        refreshed_json = await refreshed.json()
+    return current_json, cached.status, user_json, refreshed, refreshed_json
+
+
+def test_api_current_op_cached_until_new_attendance():
+    """Check the current op is served with ETag, invalidated by new attendance"""
+    # Given an attendance state with a few ops
+    state = AttendanceState()
+    state.reset(RAW_MSGS)
+    # When I query the API, with new attendance coming in between queries
+    current, cached_status, user, refreshed, refreshed_json = asyncio.run(
+        query_api(state)
+    )
+    # Then the current op is the latest one
+    assert current["op_date"] == "2022-05-22", "Should serve latest op"
+    # And re-querying with its ETag gives Not Modified
+    assert cached_status == 304, "Unchanged op should be cached by client"
+    # And user summaries are served
+    assert user["ops_attended"] == 2, "Pixy attended both ops"
+    # And new attendance invalidates the cache
+    assert refreshed.status == 200, "New attendance should change the ETag"
+    squads = [squad["squad"] for squad in refreshed_json["attendance"]]
+    assert "HQ2PLT" in squads, "New attendance should be served"
+
+
+def test_incremental_parsing_matches_full_parse():
+    """Check ops parsed message by message match parsing the whole history"""
+    # Given an empty attendance state
+    state = AttendanceState()
+    # When messages come in one by one, reading ops in between
+    for msg in RAW_MSGS:
+        state.add(msg)
+        state.latest_ops(1)
+    # Then the ops are the same as parsing the whole history at once
+    assert state.ops == parse_full_attendance_history(
+        [SEPARATOR_MSG] + msgs_obj
+    ), "Incremental parsing should match full parsing"
+    # And only the op in progress is left to re-parse on new messages
+    assert len(state.settled_ops) == 1, "Finished op should be settled"
+
+
+def test_reset_keeps_messages_heard_during_history_grab():
+    """Check messages heard live while grabbing history aren't dropped"""
+    # Given a message heard live, posted after the history was grabbed
+    state = AttendanceState()
+    state.add(new_message("HQ2PLT: Newbie"))
+    # When the state is reset with the grabbed history
+    state.reset(RAW_MSGS)
+    # Then the live message is still part of the latest op
+    squads = [squad.squad for squad in state.latest_ops(1)[0].attendance]
+    assert "HQ2PLT" in squads, "Live message should survive the reset"
+
+
+async def query_cache_keys(state: AttendanceState):
+    """Query the API with various limits and junk query strings"""
+    server = AttendanceServer(state)
+    async with TestClient(TestServer(server.app)) as client:
+        for junk in range(5):
+            await client.get(f"/ops?limit=1&x={junk}")
+        await client.get("/ops?limit=1000")
+        await client.get("/ops?limit=2")
+        zero = await client.get("/ops?limit=0")
+    return server.cache, zero.status
+
+
+def test_api_cache_keyed_on_normalized_params():
+    """Check junk query strings or huge limits don't grow the response cache"""
+    # Given an attendance state with two ops
+    state = AttendanceState()
+    state.reset(RAW_MSGS)
+    # When I query recent ops with junk params, and limits past the op count
+    cache, zero_status = asyncio.run(query_cache_keys(state))
+    # Then only one response is cached per distinct reply
+    assert set(cache) == {("ops", 1), ("ops", 2)}, "Cache keys should be normalized"
+    # And a zero limit is refused
+    assert zero_status == 400, "Limit should be positive"
+
+
+async def query_users_twice(state: AttendanceState):
+    """Query a known and an unknown user twice each"""
+    server = AttendanceServer(state)
+    async with TestClient(TestServer(server.app)) as client:
+        statuses = [
+            (await client.get(f"/users/{user}")).status
+            for user in ["Pixy", "Nobody", "Pixy", "Nobody"]
+        ]
+    return statuses
+
+
+def test_api_user_summary_computed_once(mocker):
+    """Check user summaries, found or not, are computed once per state version"""
+    # Given an attendance state with a few ops
+    state = AttendanceState()
+    state.reset(RAW_MSGS)
+    summary_spy = mocker.spy(state, "user_summary")
+    # When I query a known and an unknown user twice each
+    statuses = asyncio.run(query_users_twice(state))
+    # Then the known user is found, the unknown one isn't, both times
+    assert statuses == [200, 404, 200, 404], "Cached replies should be the same"
+    # And each summary was only computed once
+    assert summary_spy.call_count == 2, "Cache hits shouldn't compute anything"
+
+
+async def query_flagged_after_add(state: AttendanceState):
+    """Query the current op, before and after its new line is flagged bad"""
+    server = AttendanceServer(state)
+    new_msg = new_message("HQ2PLT: Newbie")
+    async with TestClient(TestServer(server.app)) as client:
+        state.add(new_msg)
+        added = await client.get("/ops/current")
+        added_json = await added.json()
+        etag = added.headers["ETag"]
+        state.replace(new_msg.copy(update={"flags": [AttendanceFlag.BAD]}))
+        flagged = await client.get("/ops/current", headers={"If-None-Match": etag})
+        flagged_json = await flagged.json()
+    return added_json, flagged.status, flagged_json
+
+
+def test_api_drops_line_flagged_bad_after_added():
+    """Check a line flagged bad once served drops out of the current op"""
+    # Given an attendance state with a few ops
+    state = AttendanceState()
+    state.reset(RAW_MSGS)
+    # When a new line is added to the current op, then flagged bad
+    added, flagged_status, flagged = asyncio.run(query_flagged_after_add(state))
+    # Then the line was first served
+    squads = [squad["squad"] for squad in added["attendance"]]
+    assert "HQ2PLT" in squads, "New attendance should be served"
+    # And flagging it invalidated the cache, dropping it from the current op
+    assert flagged_status == 200, "Flagging should change the ETag"
+    squads = [squad["squad"] for squad in flagged["attendance"]]
+    assert "HQ2PLT" not in squads, "Line flagged bad should be dropped"
+
+
+def test_edits_to_settled_ops_match_full_parse():
+    """Check edits to settled ops get them parsed again, as a full parse would"""
+    # Given an attendance state with a settled op
+    state = AttendanceState()
+    state.reset(RAW_MSGS)
+    assert state.settled_ops, "First op should be settled"
+    # When a line of the settled op is deleted
+    state.remove(msgs_obj[0].id)
+    # And the new-op flag is removed, merging both ops
+    unflagged = RAW_MSGS[SPLIT_INDEX + 1].copy(update={"flags": []})
+    state.replace(unflagged)
+    merged_ops = state.ops
+    # Then the ops are the same as parsing the whole edited history
+    edited_msgs = [
+        unflagged if msg.id == unflagged.id else msg
+        for msg in RAW_MSGS
+        if msg.id != msgs_obj[0].id
+    ]
+    assert merged_ops == parse_full_attendance_history(
+        preprocess_messages(edited_msgs)
+    ), "Edited ops should be parsed again"
+    assert len(merged_ops) == 1, "Unflagged op should be merged to the previous one"
+    # And user summaries no longer count the merged op
+    toll = state.user_summary("Toll")
+    assert toll is None, "Deleted line's users shouldn't be counted"
+    pixy = state.user_summary("Pixy")
+    assert pixy is not None and pixy.ops_attended == 1, "Ops should be merged"